@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from utils import (
+    upload_key,
     load_and_validate_data, 
+    build_session_index,
     analyze_clickstream,
     analyze_conversion_funnel,
     analyze_session_metrics
@@ -53,10 +58,22 @@ if uploaded_file is not None:
     if error:
         st.error(error)
     else:
-        # Analyze clickstream
-        clickstream_analysis = analyze_clickstream(df)
-        funnel_stages, funnel_rates = analyze_conversion_funnel(df)
-        session_metrics = analyze_session_metrics(df)
+        # Cached analyses are keyed on a digest of the full upload rather than on sampled data
+        data_key = upload_key(uploaded_file)
+
+        # Session boundaries and code arrays are built once and shared by every analysis
+        sessions = build_session_index(data_key, df)
+
+        # Run the independent analyses concurrently; NumPy and pandas release the GIL in their inner loops
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=3, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+            clickstream_future = executor.submit(analyze_clickstream, data_key, sessions)
+            funnel_future = executor.submit(analyze_conversion_funnel, data_key, sessions)
+            session_future = executor.submit(analyze_session_metrics, data_key, sessions)
+
+        clickstream_analysis = clickstream_future.result()
+        funnel_stages, funnel_rates = funnel_future.result()
+        session_metrics = session_future.result()
 
         # Display key metrics
         st.header("Session Overview")
@@ -86,8 +103,8 @@ if uploaded_file is not None:
 
         with col1:
             fig_paths = px.bar(
-                x=list(clickstream_analysis['common_paths'].keys()),
-                y=list(clickstream_analysis['common_paths'].values()),
+                x=clickstream_analysis['common_paths'].index,
+                y=clickstream_analysis['common_paths'].values,
                 title='Most Common Navigation Paths',
                 labels={'x': 'Path', 'y': 'Frequency'}
             )
@@ -95,8 +112,8 @@ if uploaded_file is not None:
 
         with col2:
             fig_actions = px.bar(
-                x=list(clickstream_analysis['action_sequences'].keys()),
-                y=list(clickstream_analysis['action_sequences'].values()),
+                x=clickstream_analysis['action_sequences'].index,
+                y=clickstream_analysis['action_sequences'].values,
                 title='Common Action Sequences',
                 labels={'x': 'Action Sequence', 'y': 'Frequency'}
             )
@@ -110,24 +127,24 @@ if uploaded_file is not None:
 
         with col1:
             fig_entry = px.pie(
-                values=list(session_metrics['top_entry_pages'].values()),
-                names=list(session_metrics['top_entry_pages'].keys()),
+                values=session_metrics['top_entry_pages'].values,
+                names=session_metrics['top_entry_pages'].index,
                 title='Top Entry Pages'
             )
             st.plotly_chart(fig_entry, use_container_width=True)
 
         with col2:
             fig_exit = px.pie(
-                values=list(session_metrics['top_exit_pages'].values()),
-                names=list(session_metrics['top_exit_pages'].keys()),
+                values=session_metrics['top_exit_pages'].values,
+                names=session_metrics['top_exit_pages'].index,
                 title='Top Exit Pages'
             )
             st.plotly_chart(fig_exit, use_container_width=True)
 
         # Session Depth Distribution
         fig_depth = px.bar(
-            x=list(session_metrics['depth_distribution'].keys()),
-            y=list(session_metrics['depth_distribution'].values()),
+            x=session_metrics['depth_distribution'].index,
+            y=session_metrics['depth_distribution'].values,
             title='Session Depth Distribution',
             labels={'x': 'Number of Pages', 'y': 'Number of Sessions'}
         )
@@ -138,8 +155,8 @@ if uploaded_file is not None:
 
         # Create color map for categories
         click_pattern_data = pd.DataFrame({
-            'pattern': list(clickstream_analysis['click_patterns'].keys()),
-            'clicks': list(clickstream_analysis['click_patterns'].values())
+            'pattern': clickstream_analysis['click_patterns'].index,
+            'clicks': clickstream_analysis['click_patterns'].values
         })
         click_pattern_data['is_electronics'] = click_pattern_data['pattern'].str.startswith('Electronics')
 
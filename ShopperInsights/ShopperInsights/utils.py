@@ -1,30 +1,119 @@
+import hashlib
+import io
+from collections import Counter, namedtuple
+
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+import streamlit as st
+from sklearn.cluster import MiniBatchKMeans
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def upload_key(file):
+    """Digest of the uploaded bytes, used to key the cached analyses"""
+    # Streamlit hashes large frames and arrays from a sample, so cache on the full upload instead
+    return hashlib.sha256(file.getvalue()).hexdigest()
 
 def load_and_validate_data(file):
     """Load and validate uploaded clickstream data"""
+    # Hash the raw upload bytes rather than the parsed frame so reruns hit the cache cheaply
+    return _parse_clickstream(file.getvalue())
+
+def _read_csv(data, columns):
+    """Read the given columns from clickstream CSV bytes, preferring the multithreaded pyarrow parser"""
+    try:
+        return pd.read_csv(io.BytesIO(data), engine='pyarrow', usecols=columns, parse_dates=['Timestamp'])
+    except (ImportError, ValueError):
+        # pyarrow is missing or rejected the file: fall back to bounded-size chunks
+        chunks = pd.read_csv(io.BytesIO(data), usecols=columns, chunksize=500_000, parse_dates=['Timestamp'])
+        return pd.concat(chunks, ignore_index=True)
+
+# Cached by reference and shared across reruns: callers must treat the frame as read-only.
+# Only the latest couple of uploads are kept so old frames do not live for the whole server process.
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _parse_clickstream(data):
+    """Parse and validate clickstream CSV bytes"""
     try:
-        df = pd.read_csv(file)
         required_columns = ['User_ID', 'Session_ID', 'Timestamp', 'Page_Type', 'Product_ID', 'Category', 'Action', 'Device_Type', 'Platform']
 
-        if not all(col in df.columns for col in required_columns):
+        # Validate the header before parsing the full file
+        header = pd.read_csv(io.BytesIO(data), nrows=0)
+        if not all(col in header.columns for col in required_columns):
             return None, "Missing required columns in the clickstream data"
 
+        # Only the required columns are parsed; anything else in the file is dropped
+        df = _read_csv(data, required_columns)
+        # parse_dates leaves unparseable values as strings; convert explicitly so they are reported as errors
         df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+        # Store naive UTC so the session arrays hold datetime64 values rather than Timestamp objects
+        if df['Timestamp'].dt.tz is not None:
+            df['Timestamp'] = df['Timestamp'].dt.tz_convert(None)
+
+        # Categorical columns let groupbys and comparisons work on integer codes
+        categorical_columns = ['User_ID', 'Session_ID', 'Page_Type', 'Product_ID', 'Category', 'Action', 'Device_Type', 'Platform']
+        for col in categorical_columns:
+            df[col] = df[col].astype('category')
+
+        # Keep each session's rows contiguous and in time order for the session analyses
+        df = df.sort_values(['Session_ID', 'Timestamp'], kind='mergesort', ignore_index=True)
+
         return df, None
     except Exception as e:
         return None, f"Error loading data: {str(e)}"
 
+# Struct-of-arrays view of a frame sorted by (Session_ID, Timestamp); rows of session i are starts[i]:ends[i]
+# and each *_codes array indexes into the matching tuple of category labels.
+SessionIndex = namedtuple('SessionIndex', [
+    'session_codes', 'starts', 'ends', 'page_codes', 'action_codes', 'category_codes', 'timestamps',
+    'page_types', 'actions', 'categories'
+])
+
+# Cached by reference like the parsed frame and keyed on the upload digest, since Streamlit
+# would otherwise hash the frame from a sample. The arrays must be treated as read-only.
+@st.cache_resource(show_spinner=False, max_entries=2)
+def build_session_index(data_key, _df):
+    """Build the shared session boundary and code arrays for a loaded clickstream frame"""
+    return _session_index(_df)
+
+def _session_index(df):
+    """Compute the session boundary and code arrays of a frame sorted by session"""
+    session_codes = df['Session_ID'].cat.codes.to_numpy()
+    # Rows without a Session_ID (code -1) sort last and belong to no session
+    n_rows = np.count_nonzero(session_codes >= 0)
+    if n_rows == 0:
+        # A header-only upload has no sessions at all
+        starts = ends = np.empty(0, dtype=np.intp)
+    else:
+        starts = np.flatnonzero(np.r_[True, session_codes[1:n_rows] != session_codes[:n_rows - 1]])
+        ends = np.r_[starts[1:], n_rows]
+
+    return SessionIndex(
+        session_codes=session_codes,
+        starts=starts,
+        ends=ends,
+        page_codes=df['Page_Type'].cat.codes.to_numpy(),
+        action_codes=df['Action'].cat.codes.to_numpy(),
+        category_codes=df['Category'].cat.codes.to_numpy(),
+        timestamps=df['Timestamp'].to_numpy(),
+        page_types=tuple(df['Page_Type'].cat.categories),
+        actions=tuple(df['Action'].cat.categories),
+        categories=tuple(df['Category'].cat.categories)
+    )
+
 def calculate_key_metrics(df):
     """Calculate key e-commerce metrics"""
+    # Group rather than reuse the session index: callers may pass any frame, sorted or not
+    session_sizes = df.groupby('Session_ID', observed=True, sort=False).size()
     metrics = {
         'total_users': df['User_ID'].nunique(),
-        'total_sessions': df['Session_ID'].nunique(),
-        'conversion_rate': (df[df['Action'] == 'Purchase'].User_ID.nunique() / df['User_ID'].nunique() * 100),
-        'avg_pages_per_session': df.groupby('Session_ID').size().mean(),
-        'bounce_rate': (df.groupby('Session_ID').size().value_counts()[1] / len(df['Session_ID'].unique()) * 100)
+        'total_sessions': len(session_sizes),
+        'conversion_rate': (df.loc[df['Action'] == 'Purchase', 'User_ID'].nunique() / df['User_ID'].nunique() * 100),
+        'avg_pages_per_session': session_sizes.mean(),
+        # Share of single-page sessions; zero rather than a KeyError when there are none
+        'bounce_rate': (session_sizes == 1).mean() * 100
     }
     return metrics
 
@@ -34,7 +123,7 @@ def analyze_user_behavior(df):
     device_usage = df['Device_Type'].value_counts().to_dict()
 
     # Popular categories
-    category_popularity = df['Category'].value_counts().head(5).to_dict()
+    category_popularity = df['Category'].value_counts(sort=False).nlargest(5).to_dict()
 
     # User actions distribution
     action_dist = df['Action'].value_counts().to_dict()
@@ -43,8 +132,9 @@ def analyze_user_behavior(df):
     platform_dist = df['Platform'].value_counts().to_dict()
 
     # Time analysis
-    df['Hour'] = df['Timestamp'].dt.hour
-    hourly_activity = df.groupby('Hour').size().to_dict()
+    # Rows without a timestamp have a NaN hour and are left out, as the hourly groupby did
+    hour = df['Timestamp'].dt.hour.dropna().to_numpy(dtype=np.int64)
+    hourly_activity = dict(enumerate(np.bincount(hour, minlength=24).tolist()))
 
     return {
         'device_usage': device_usage,
@@ -57,23 +147,25 @@ def analyze_user_behavior(df):
 def analyze_product_sales(df):
     """Analyze product sales and trends"""
     # Filter purchases
-    purchases = df[df['Action'] == 'Purchase']
+    is_purchase = df['Action'] == 'Purchase'
+    purchases = df.loc[is_purchase, ['Product_ID', 'Category', 'Timestamp', 'Platform']]
 
     # Get top selling products
-    top_products = purchases.groupby('Product_ID').size().sort_values(ascending=False)
+    top_products = purchases.groupby('Product_ID', observed=True, sort=False).size().nlargest(10)
 
     # Get sales by category
-    category_sales = purchases['Category'].value_counts()
+    # Categorical value_counts lists every category; keep only those with purchases
+    category_sales = purchases['Category'].value_counts().loc[lambda counts: counts > 0]
 
     # Monthly sales trend
-    purchases['Month'] = purchases['Timestamp'].dt.strftime('%Y-%m')
-    monthly_sales = purchases.groupby('Month').size().sort_index()
+    months = purchases['Timestamp'].dt.strftime('%Y-%m').rename('Month')
+    monthly_sales = purchases.groupby(months, observed=True, sort=False).size().sort_index()
 
     # Sales by platform
-    platform_sales = purchases['Platform'].value_counts()
+    platform_sales = purchases['Platform'].value_counts().loc[lambda counts: counts > 0]
 
     return {
-        'top_products': top_products.head(10).to_dict(),
+        'top_products': top_products.to_dict(),
         'category_sales': category_sales.to_dict(),
         'monthly_sales': monthly_sales.to_dict(),
         'platform_sales': platform_sales.to_dict()
@@ -82,19 +174,20 @@ def analyze_product_sales(df):
 def segment_users(df):
     """Segment users based on their behavior"""
     # Create user-level features
-    user_features = df.groupby('User_ID').agg({
+    user_features = df.groupby('User_ID', observed=True, sort=False).agg({
         'Session_ID': 'nunique',  # Number of sessions
         'Action': lambda x: (x == 'Purchase').sum(),  # Number of purchases
         'Category': 'nunique',  # Category diversity
         'Platform': 'nunique'  # Platform diversity
     })
 
-    # Standardize features
-    scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(user_features)
+    # Standardize features in place on a single float32 copy
+    features_scaled = user_features.to_numpy(dtype=np.float32)
+    features_scaled -= features_scaled.mean(axis=0)
+    features_scaled /= features_scaled.std(axis=0) + 1e-9
 
     # Perform clustering
-    kmeans = KMeans(n_clusters=4, random_state=42)
+    kmeans = MiniBatchKMeans(n_clusters=4, random_state=42, batch_size=4096, n_init=3)
     user_features['Segment'] = kmeans.fit_predict(features_scaled)
 
     # Calculate segment characteristics
@@ -103,61 +196,175 @@ def segment_users(df):
     return user_features, segment_profile
 
 
-def analyze_clickstream(df):
+def _label_mask(codes, labels, value):
+    """Mask of the rows whose categorical code stands for the given label"""
+    if value not in labels:
+        return np.zeros(len(codes), dtype=bool)
+    return codes == labels.index(value)
+
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _count_sequences(codes, starts, ends):
+        """Count distinct per-session code sequences in an open-addressing table keyed by FNV-1a hashes"""
+        n_sessions = len(starts)
+        capacity = 1
+        while capacity < 2 * n_sessions:
+            capacity *= 2
+        slot_mask = np.uint64(capacity - 1)
+        slot_hash = np.zeros(capacity, dtype=np.uint64)
+        slot_session = np.full(capacity, -1, dtype=np.int64)
+        slot_count = np.zeros(capacity, dtype=np.int64)
+
+        for session in range(n_sessions):
+            start, end = starts[session], ends[session]
+            h = np.uint64(14695981039346656037)
+            for i in range(start, end):
+                h ^= np.uint64(codes[i])
+                h *= np.uint64(1099511628211)
+
+            slot = h & slot_mask
+            while True:
+                first = slot_session[slot]
+                if first == -1:
+                    slot_hash[slot] = h
+                    slot_session[slot] = session
+                    slot_count[slot] = 1
+                    break
+                # Confirm the match against the first session stored in the slot so hash collisions stay exact
+                if slot_hash[slot] == h and ends[first] - starts[first] == end - start:
+                    same = True
+                    for offset in range(end - start):
+                        if codes[starts[first] + offset] != codes[start + offset]:
+                            same = False
+                            break
+                    if same:
+                        slot_count[slot] += 1
+                        break
+                slot = (slot + np.uint64(1)) & slot_mask
+
+        occupied = slot_session >= 0
+        return slot_session[occupied], slot_count[occupied]
+
+def _code_counts(codes, labels):
+    """Count categorical codes by label, skipping blank (-1) codes and labels that never occur"""
+    counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+    observed = np.flatnonzero(counts)
+    return pd.Series(counts[observed], index=[labels[code] for code in observed])
+
+def _top_sequences(codes, labels, starts, ends, n=10):
+    """Count the most common per-session sequences of categorical codes"""
+    if len(starts) == 0:
+        # No sessions, so no sequences; np.split would otherwise yield one empty chunk
+        return pd.Series([], index=[], dtype=np.int64, name='count')
+
+    if njit is not None:
+        # Rank by count, breaking ties by first occurrence like Counter.most_common
+        first_sessions, counts = _count_sequences(codes, starts, ends)
+        order = np.lexsort((first_sessions, -counts))[:n]
+        top = [(codes[starts[first]:ends[first]], count) for first, count in zip(first_sessions[order], counts[order])]
+    else:
+        # Key each session by the raw bytes of its category codes and only decode the top n
+        counts = Counter(map(bytes, np.split(codes[:ends[-1]], starts[1:])))
+        top = [(np.frombuffer(key, dtype=codes.dtype), count) for key, count in counts.most_common(n)]
+
+    return pd.Series(
+        [int(count) for _, count in top],
+        # Blank values (code -1) are labelled explicitly rather than wrapping to the last label
+        index=['->'.join(labels[code] if code >= 0 else 'Unknown' for code in key) for key, _ in top],
+        name='count'
+    )
+
+@st.cache_data(show_spinner=False)
+def analyze_clickstream(data_key, _sessions):
     """Analyze clickstream patterns"""
-    # Session analysis remains unchanged
-    session_stats = df.groupby('Session_ID').agg({
-        'Timestamp': lambda x: (x.max() - x.min()).total_seconds(),
-        'Page_Type': 'count',
-        'Action': 'nunique'
-    }).rename(columns={
-        'Timestamp': 'duration_seconds',
-        'Page_Type': 'page_views',
-        'Action': 'unique_actions'
-    })
+    # Per-session stats come only from the boundary arrays; fmin/fmax skip NaT like the min/max aggregations
+    starts, ends = _sessions.starts, _sessions.ends
+    if len(starts):
+        timestamps = _sessions.timestamps[:ends[-1]]
+        spans = np.fmax.reduceat(timestamps, starts) - np.fmin.reduceat(timestamps, starts)
+        durations = spans / np.timedelta64(1, 's')
+    else:
+        durations = np.empty(0)
+    page_views = ends - starts
 
     # Navigation paths
-    path_analysis = df.groupby('Session_ID')['Page_Type'].agg(lambda x: '->'.join(x)).value_counts().head(10)
+    path_analysis = _top_sequences(_sessions.page_codes, _sessions.page_types, _sessions.starts, _sessions.ends)
 
     # Action sequences
-    action_sequences = df.groupby('Session_ID')['Action'].agg(lambda x: '->'.join(x)).value_counts().head(10)
-
-    # Page type transitions
-    df['next_page'] = df.groupby('Session_ID')['Page_Type'].shift(-1)
-    transitions = df[df['next_page'].notna()].groupby(['Page_Type', 'next_page']).size()
+    action_sequences = _top_sequences(_sessions.action_codes, _sessions.actions, _sessions.starts, _sessions.ends)
+
+    # Page type transitions between neighbouring rows of the same session, skipping blank page types
+    page_codes = _sessions.page_codes
+    session_codes = _sessions.session_codes
+    same_session = (
+        (session_codes[1:] == session_codes[:-1]) & (session_codes[1:] >= 0)
+        & (page_codes[1:] >= 0) & (page_codes[:-1] >= 0)
+    )
+    page_pairs, pair_counts = np.unique(
+        np.column_stack([page_codes[:-1], page_codes[1:]])[same_session],
+        axis=0,
+        return_counts=True
+    )
+    page_labels = np.array(_sessions.page_types, dtype=object)
+    transitions = pd.Series(pair_counts, index=pd.MultiIndex.from_arrays(
+        [page_labels[page_pairs[:, 0]], page_labels[page_pairs[:, 1]]],
+        names=['Page_Type', 'next_page']
+    ))
 
     # Enhanced click patterns focusing on electronics
-    clicks_df = df[df['Action'] == 'Click'].copy()
-    click_counts = clicks_df.groupby(['Category', 'Page_Type']).size().reset_index(name='clicks')
+    is_click = (
+        _label_mask(_sessions.action_codes, _sessions.actions, 'Click')
+        & (_sessions.category_codes >= 0) & (page_codes >= 0)
+    )
+    click_pairs, click_totals = np.unique(
+        np.column_stack([_sessions.category_codes[is_click], page_codes[is_click]]),
+        axis=0,
+        return_counts=True
+    )
+    click_counts = pd.DataFrame({
+        'Category': np.array(_sessions.categories, dtype=object)[click_pairs[:, 0]],
+        'Page_Type': page_labels[click_pairs[:, 1]],
+        'clicks': click_totals
+    })
 
     # Sort to prioritize electronics
     click_counts['is_electronics'] = click_counts['Category'] == 'Electronics'
     click_counts = click_counts.sort_values(['is_electronics', 'clicks'], ascending=[False, False])
 
-    # Create formatted labels and dictionary
-    click_patterns = {
-        f"{row['Category']} - {row['Page_Type']}": row['clicks']
-        for _, row in click_counts.head(10).iterrows()
-    }
+    # Label the top patterns as "Category - Page Type"
+    top_clicks = click_counts.head(10)
+    click_patterns = pd.Series(
+        top_clicks['clicks'].to_numpy(),
+        index=top_clicks['Category'].astype(str) + ' - ' + top_clicks['Page_Type'].astype(str),
+        name='clicks'
+    )
 
     return {
-        'avg_session_duration': session_stats['duration_seconds'].mean(),
-        'avg_page_views': session_stats['page_views'].mean(),
-        'common_paths': path_analysis.to_dict(),
-        'action_sequences': action_sequences.to_dict(),
-        'top_transitions': transitions.head(10).to_dict(),
+        # Sessions without any valid timestamp have no duration and are left out of the average
+        'avg_session_duration': np.nanmean(durations),
+        'avg_page_views': page_views.mean(),
+        'common_paths': path_analysis,
+        'action_sequences': action_sequences,
+        'top_transitions': transitions.nlargest(10),
         'click_patterns': click_patterns
     }
 
-def analyze_conversion_funnel(df):
+@st.cache_data(show_spinner=False)
+def analyze_conversion_funnel(data_key, _sessions):
     """Analyze the conversion funnel from view to purchase"""
-    total_sessions = df['Session_ID'].nunique()
-
+    total_sessions = len(_sessions.starts)
+
+    # Distinct sessions per action: unique (session, action) code pairs, counted by action
+    # Rows missing either code would otherwise wrap into the wrong action under the modulo
+    n_actions = len(_sessions.actions)
+    known = (_sessions.session_codes >= 0) & (_sessions.action_codes >= 0)
+    pair_keys = np.unique(
+        _sessions.session_codes[known].astype(np.int64) * n_actions + _sessions.action_codes[known]
+    )
+    stage_counts = pd.Series(np.bincount(pair_keys % n_actions, minlength=n_actions), index=list(_sessions.actions))
     funnel_stages = {
-        'View': df[df['Action'] == 'View']['Session_ID'].nunique(),
-        'Click': df[df['Action'] == 'Click']['Session_ID'].nunique(),
-        'Add to Cart': df[df['Action'] == 'Add to Cart']['Session_ID'].nunique(),
-        'Purchase': df[df['Action'] == 'Purchase']['Session_ID'].nunique()
+        stage: int(stage_counts.get(stage, 0))
+        for stage in ('View', 'Click', 'Add to Cart', 'Purchase')
     }
 
     # Calculate conversion rates
@@ -168,25 +375,35 @@ def analyze_conversion_funnel(df):
 
     return funnel_stages, funnel_rates
 
-def analyze_session_metrics(df):
+@st.cache_data(show_spinner=False)
+def analyze_session_metrics(data_key, _sessions):
     """Calculate detailed session metrics"""
     session_metrics = {}
+    page_codes = _sessions.page_codes
+
+    # Time on page by page type, ignoring rows with a blank Page_Type
+    has_page = page_codes >= 0
+    page_spans = (
+        pd.Series(_sessions.timestamps[has_page])
+        .groupby(page_codes[has_page], sort=False)
+        .agg(['min', 'max'])
+    )
+    time_on_page = pd.Series({
+        'Timestamp': (page_spans['max'] - page_spans['min']).dt.total_seconds().mean()
+    })
 
-    # Time on page by page type
-    time_on_page = df.groupby('Page_Type').agg({
-        'Timestamp': lambda x: (x.max() - x.min()).total_seconds()
-    }).mean()
-
-    # Entry and exit pages
-    entry_pages = df.groupby('Session_ID')['Page_Type'].first().value_counts()
-    exit_pages = df.groupby('Session_ID')['Page_Type'].last().value_counts()
+    # Entry and exit pages are the page codes at each session's first and last row
+    entry_pages = _code_counts(page_codes[_sessions.starts], _sessions.page_types).nlargest(5)
+    exit_pages = _code_counts(page_codes[_sessions.ends - 1], _sessions.page_types).nlargest(5)
 
-    # Session depth distribution
-    session_depth = df.groupby('Session_ID').size().value_counts()
+    # Session depth distribution from the session run lengths
+    depth_counts = np.bincount(_sessions.ends - _sessions.starts)
+    observed_depths = np.flatnonzero(depth_counts)
+    session_depth = pd.Series(depth_counts[observed_depths], index=observed_depths).nlargest(10)
 
-    session_metrics['avg_time_by_page'] = time_on_page.to_dict()
-    session_metrics['top_entry_pages'] = entry_pages.head(5).to_dict()
-    session_metrics['top_exit_pages'] = exit_pages.head(5).to_dict()
-    session_metrics['depth_distribution'] = session_depth.head(10).to_dict()
+    session_metrics['avg_time_by_page'] = time_on_page
+    session_metrics['top_entry_pages'] = entry_pages
+    session_metrics['top_exit_pages'] = exit_pages
+    session_metrics['depth_distribution'] = session_depth
 
-    return session_metrics
\ No newline at end of file
+    return session_metrics